@@ -3,10 +3,12 @@ package main
 import (
 	"bytes"
 	"context"
+	"errors"
 	"fmt"
 	"image/png"
 	"log"
 	"math/rand"
+	"net"
 	"net/http"
 	"os"
 
@@ -77,8 +79,28 @@ func main() {
 		resp, err := client.R().Get(url)
 
 		if err != nil {
-			w.WriteHeader(http.StatusNotFound)
+			// Ошибка сети - временная, клиент должен повторить запрос позже
+			status := http.StatusBadGateway
+			var netErr net.Error
+			if errors.As(err, &netErr) && netErr.Timeout() {
+				status = http.StatusGatewayTimeout
+			}
+			w.WriteHeader(status)
 			w.Write([]byte(err.Error()))
+			return
+		}
+
+		switch resp.StatusCode() {
+		case http.StatusOK:
+		case http.StatusNotFound, http.StatusGone:
+			w.WriteHeader(http.StatusNotFound)
+			w.Write([]byte("Tile not found"))
+			return
+		default:
+			log.Printf("Upstream ответил %d на %s\n", resp.StatusCode(), url)
+			w.WriteHeader(http.StatusBadGateway)
+			w.Write([]byte("Upstream error"))
+			return
 		}
 
 		if tile := resp.Body(); isValidPNG(tile) {
@@ -1,8 +1,10 @@
 import re
 import sys
 import redis
+import hashlib
 import random as rnd
 
+from collections import OrderedDict
 from PySide6.QtWidgets import QApplication
 from functools import partial
 from math import pow
@@ -21,6 +23,33 @@ from PySide6.QtNetwork import (
 
 redis_connection = redis.Redis(host="localhost", port=6379, db=0)
 
+# Tile keys store a reference to a content-addressed blob, so identical
+# tiles (open sea, empty land) are kept in Redis only once
+TILE_BLOB_PREFIX = "tile_blob_"
+TILE_REF_PREFIX = b"ref:"
+
+
+def tile_digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def read_tile(tile_name):
+    """Returns tile bytes, following a blob reference if the key holds one"""
+    data = redis_connection.get(tile_name)
+    if data is not None and data.startswith(TILE_REF_PREFIX):
+        digest = data[len(TILE_REF_PREFIX) :].decode("utf-8")
+        data = redis_connection.get(TILE_BLOB_PREFIX + digest)
+    return data
+
+
+def write_tile(tile_name, data):
+    """Stores the payload once under its digest and points the tile key at it"""
+    digest = tile_digest(data)
+    pipeline = redis_connection.pipeline()
+    pipeline.set(TILE_BLOB_PREFIX + digest, data, nx=True)
+    pipeline.set(tile_name, TILE_REF_PREFIX + digest.encode("utf-8"))
+    pipeline.execute()
+
 
 def check_and_extract_numbers(filename):
     # Template for file name validation
@@ -72,6 +101,11 @@ class OSMGraphicsView(QGraphicsView):
         self.tile_size = 256  # The size of one tile in pixels
         self.zoom = zoom  # Current zoom level
         self.tiles = {}  # Loaded tiles: key (zoom, x, y)
+        # Decoded tiles shared by content (LRU): digest -> QPixmap
+        self.pixmaps = OrderedDict()
+        self.max_pixmaps = 512
+        self.tile_count = 0  # Tiles received, for the dedup ratio
+        self.decode_count = 0  # Payloads actually decoded
         self.old_tiles_group = None  # Group for scaling animation
         self._zoom_anim = None  # Link to zoom animation
 
@@ -95,9 +129,11 @@ class OSMGraphicsView(QGraphicsView):
 
         for key in redis_connection.keys():
             tile_name = key.decode("utf-8")
+            if tile_name.startswith(TILE_BLOB_PREFIX):
+                continue
             is_valid, numbers = check_and_extract_numbers(tile_name)
             if is_valid:
-                data = redis_connection.get(tile_name)
+                data = read_tile(tile_name)
                 self.cache[tuple(numbers)] = data
 
                 print(f"The tile {tuple(numbers)} is loaded into cache ")
@@ -133,10 +169,9 @@ class OSMGraphicsView(QGraphicsView):
         """Generates a tile URL and starts asynchronous loading"""
 
         tile_name = f"{x}_{y}_{z}_tile"
-        if redis_connection.exists(tile_name):
-            data = redis_connection.get(tile_name)
-            pixmap = QPixmap()
-            pixmap.loadFromData(data)
+        data = read_tile(tile_name)
+        if data is not None:
+            pixmap = self.pixmapForData(data)
             item = QGraphicsPixmapItem(pixmap)
             # We place the tile according to its coordinates for a given zoom
             item.setPos(x * self.tile_size, y * self.tile_size)
@@ -171,9 +206,8 @@ class OSMGraphicsView(QGraphicsView):
             reply.deleteLater()
             return
 
-        data = reply.readAll()
-        pixmap = QPixmap()
-        pixmap.loadFromData(data)
+        data = bytes(reply.readAll())
+        pixmap = self.pixmapForData(data)
 
         if pixmap.isNull():
             reply.deleteLater()
@@ -189,7 +223,33 @@ class OSMGraphicsView(QGraphicsView):
         reply.deleteLater()
 
         tile_name = f"{x}_{y}_{z}_tile"
-        redis_connection.set(tile_name, bytes(data))
+        write_tile(tile_name, data)
+
+    def pixmapForData(self, data):
+        """Decodes a tile once per distinct payload and shares the QPixmap"""
+        self.tile_count += 1
+        digest = tile_digest(data)
+        pixmap = self.pixmaps.get(digest)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(digest)
+        else:
+            pixmap = QPixmap()
+            pixmap.loadFromData(data)
+            if pixmap.isNull():
+                return pixmap
+            self.decode_count += 1
+            self.pixmaps[digest] = pixmap
+            while len(self.pixmaps) > self.max_pixmaps:
+                self.pixmaps.popitem(last=False)
+
+        self.setWindowTitle(
+            f"OpenStreetMap Viewer - tiles per decode: {self.dedupRatio():.2f}"
+        )
+        return pixmap
+
+    def dedupRatio(self):
+        """Tiles received per decoded payload"""
+        return self.tile_count / self.decode_count if self.decode_count else 1.0
 
     def clearOldTilesGroup(self):
         """Removes an animated group of old tiles after the animation is complete"""
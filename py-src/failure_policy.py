@@ -0,0 +1,124 @@
+import time
+import random as rnd
+
+from collections import OrderedDict, deque
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """
+    Задержка перед повтором номер attempt (с единицы) в секундах:
+    экспоненциальный рост с полным случайным разбросом, чтобы повторы
+    многих тайлов не приходили на сервер одновременно.
+    """
+    return rnd.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class NegativeCache:
+    """Тайлы, которые не удалось загрузить, со временем жизни записи"""
+
+    def __init__(self, ttl=300.0, max_entries=10000):
+        self.ttl = ttl  # с
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # ключ -> момент истечения
+
+    def add(self, key, ttl=None):
+        self.entries.pop(key, None)
+        self.entries[key] = time.monotonic() + (self.ttl if ttl is None else ttl)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def contains(self, key):
+        expires = self.entries.get(key)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self.entries[key]
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты одного upstream.
+
+    Закрыт - запросы идут как обычно. Если среди последних window ответов
+    доля ошибок достигает failure_rate, автомат размыкается и на open_time
+    секунд запрещает новые запросы. Затем пропускает один пробный запрос:
+    успех замыкает автомат, ошибка снова размыкает его на вдвое большее время.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window=20, min_requests=10, failure_rate=0.5, open_time=5.0):
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.base_open_time = open_time  # с
+        self.max_open_time = 60.0  # с
+
+        self.state = self.CLOSED
+        self.outcomes = deque(maxlen=window)  # True - ошибка
+        self.open_time = open_time
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allowRequest(self):
+        if self.state == self.OPEN:
+            if self.retryAfter() > 0:
+                return False
+            self.state = self.HALF_OPEN
+            self.probing = False
+
+        if self.state == self.HALF_OPEN:
+            return not self.probing
+
+        return True
+
+    def onRequest(self):
+        if self.state == self.HALF_OPEN:
+            self.probing = True
+
+    def recordSuccess(self):
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+            self.outcomes.clear()
+            self.open_time = self.base_open_time
+            self.probing = False
+        self.outcomes.append(False)
+
+    def recordFailure(self):
+        if self.state == self.HALF_OPEN:
+            self.open(min(self.open_time * 2, self.max_open_time))
+            return
+        if self.state == self.OPEN:
+            return
+
+        self.outcomes.append(True)
+        failures = sum(self.outcomes)
+        if (
+            len(self.outcomes) >= self.min_requests
+            and failures >= self.failure_rate * len(self.outcomes)
+        ):
+            self.open(self.base_open_time)
+
+    def open(self, open_time):
+        self.state = self.OPEN
+        self.open_time = open_time
+        self.opened_at = time.monotonic()
+        self.probing = False
+        print(f"Upstream недоступен, запросы приостановлены на {open_time:.0f} с")
+
+    def retryAfter(self):
+        """
+        Сколько секунд осталось до пробного запроса. None - пробный запрос
+        уже выполняется, и ждать нужно его ответа, а не времени.
+        """
+        if self.state == self.HALF_OPEN and self.probing:
+            return None
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_time - time.monotonic())
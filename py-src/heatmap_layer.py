@@ -0,0 +1,296 @@
+import weakref
+import shiboken6
+import numpy as np
+
+from collections import OrderedDict
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtGui import QImage, QPixmap
+
+MAX_LATITUDE = 85.05112878  # Предел широты проекции Web-Mercator
+
+# Опорные точки палитры: плотность 0..1 -> RGBA
+HEATMAP_STOPS = [
+    (0.00, (0, 0, 255, 0)),
+    (0.25, (0, 128, 255, 120)),
+    (0.50, (0, 255, 128, 170)),
+    (0.75, (255, 255, 0, 200)),
+    (1.00, (255, 0, 0, 230)),
+]
+
+
+def mercator(lat, lon):
+    """
+    Векторная версия формулы OSMGraphicsView.latLonToTile для уровня 0:
+    координаты точек в долях ширины мира [0, 1). На уровне z тайловые
+    координаты равны mercator(lat, lon) * 2**z.
+    """
+    lat_rad = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    mx = (lon + 180.0) / 360.0
+    my = (1.0 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi) / 2.0
+    return mx, my
+
+
+def build_palette(stops=HEATMAP_STOPS):
+    """Таблица из 256 цветов RGBA (uint8) по опорным точкам"""
+    positions = np.linspace(0.0, 1.0, 256)
+    xs = [stop for stop, _ in stops]
+    channels = [
+        np.interp(positions, xs, [color[i] for _, color in stops]) for i in range(4)
+    ]
+    return np.stack(channels, axis=1).astype(np.uint8)
+
+
+def gaussian_kernel(sigma):
+    radius = max(int(3 * sigma), 1)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(offsets**2) / (2.0 * sigma**2))
+    return kernel / kernel.sum()
+
+
+def blur(grid, kernel):
+    """Разделимое гауссово размытие; края grid служат запасом и обрезаются"""
+    radius = len(kernel) // 2
+    rows = sum(
+        k * grid[:, i : grid.shape[1] - 2 * radius + i] for i, k in enumerate(kernel)
+    )
+    return sum(
+        k * rows[i : rows.shape[0] - 2 * radius + i, :] for i, k in enumerate(kernel)
+    )
+
+
+def render_heatmap_tile(mx, my, z, x, y, params):
+    """
+    Строит RGBA-изображение тайла (z, x, y) по точкам mx, my, отсортированным
+    по mx. Точки раскладываются по ячейкам bin_size x bin_size пикселей
+    с запасом на радиус размытия, чтобы соседние тайлы стыковались.
+    Возвращает None, если в тайле нет точек.
+    """
+    tile_size, bin_size, kernel, saturation, palette = params
+    cells = tile_size // bin_size
+    pad = len(kernel) // 2
+    width = cells + 2 * pad
+    n = 2**z
+
+    # Отбор по mx бинарным поиском, по my - маской
+    margin = pad / cells
+    lo = np.searchsorted(mx, (x - margin) / n)
+    hi = np.searchsorted(mx, (x + 1 + margin) / n)
+    if lo == hi:
+        return None
+
+    px = np.floor((mx[lo:hi] * n - x) * cells).astype(np.int64) + pad
+    py = np.floor((my[lo:hi] * n - y) * cells).astype(np.int64) + pad
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < width)
+    if not inside.any():
+        return None
+
+    counts = np.bincount(
+        py[inside] * width + px[inside], minlength=width * width
+    ).reshape(width, width)
+    density = blur(counts.astype(np.float32), kernel)
+
+    # Логарифмическая шкала: отдельные точки видны, скопления не засвечены
+    levels = np.log1p(density) / np.log1p(saturation)
+    indices = (np.clip(levels, 0.0, 1.0) * 255).astype(np.uint8)
+    colors = palette[indices]
+    colors = np.repeat(np.repeat(colors, bin_size, axis=0), bin_size, axis=1)
+
+    image = QImage(
+        np.ascontiguousarray(colors).data,
+        tile_size,
+        tile_size,
+        tile_size * 4,
+        QImage.Format_RGBA8888,
+    )
+    return image.copy()
+
+
+class HeatmapRenderSignals(QObject):
+    rendered = Signal(object, int, QImage)
+
+
+class HeatmapRenderTask(QRunnable):
+    """Построение тайла тепловой карты в рабочем потоке"""
+
+    def __init__(self, mx, my, key, version, params, signals):
+        super().__init__()
+        self.mx = mx
+        self.my = my
+        self.key = key
+        self.version = version
+        self.params = params
+        self.signals = signals
+
+    def run(self):
+        image = render_heatmap_tile(self.mx, self.my, *self.key, self.params)
+        if image is None:
+            image = QImage()
+        self.signals.rendered.emit(self.key, self.version, image)
+
+
+class HeatmapLayer(QObject):
+    """
+    Слой тепловой карты плотности точек (широта, долгота).
+
+    Тайлы слоя строятся NumPy в рабочих потоках только для запрошенных
+    (видимых) тайлов и кэшируются по (z, x, y) в пределах cache_bytes
+    (пустые тайлы не занимают памяти изображений, их число ограничено
+    max_cached_tiles). Интерфейс тот же, что
+    у TileService: requestTile возвращает QPixmap из кэша или подписывает
+    вид, и результат приходит в handleLayerTileLoaded(layer, z, x, y, pixmap).
+    addPoints сбрасывает только тайлы, которых касаются новые точки,
+    и сообщает о них сигналом tilesInvalidated.
+    """
+
+    tilesInvalidated = Signal(list)
+
+    def __init__(
+        self,
+        tile_size=256,
+        bin_size=4,
+        sigma=2.0,
+        saturation=20.0,
+        cache_bytes=32 * 1024**2,
+        max_cached_tiles=4096,
+        parent=None,
+    ):
+        super().__init__(parent)
+
+        self.cache_bytes = cache_bytes
+        self.max_cached_tiles = max_cached_tiles
+        kernel = gaussian_kernel(sigma)
+        self.params = (tile_size, bin_size, kernel, saturation, build_palette())
+        # Запас размытия в долях тайла: точка влияет и на соседние тайлы
+        self.margin = (len(kernel) // 2) / (tile_size // bin_size)
+
+        # Точки в долях мира, отсортированные по mx. Массивы не изменяются
+        # на месте, поэтому задачи рендера держат согласованный снимок
+        self.mx = np.empty(0)
+        self.my = np.empty(0)
+
+        # LRU: (z, x, y) -> (QPixmap, размер в байтах); null - пустой тайл
+        self.cache = OrderedDict()
+        self.cache_size = 0  # Байт в кэше
+        self.versions = {}  # (z, x, y) -> номер версии, растёт при сбросе
+        self.rendering = set()  # Тайлы, которые сейчас строятся
+        self.subscribers = {}  # (z, x, y) -> виды, ожидающие тайл
+
+        self.render_pool = QThreadPool.globalInstance()
+        self.render_signals = HeatmapRenderSignals(self)
+        self.render_signals.rendered.connect(self.handleTileRendered)
+
+    def addPoints(self, lat, lon):
+        mx, my = mercator(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+        if mx.size == 0:
+            return
+
+        all_mx = np.concatenate([self.mx, mx])
+        all_my = np.concatenate([self.my, my])
+        order = np.argsort(all_mx, kind="stable")
+        self.mx = all_mx[order]
+        self.my = all_my[order]
+
+        self.invalidate(mx, my)
+
+    def invalidate(self, mx, my):
+        """Сбрасывает известные тайлы, на которые влияют точки mx, my"""
+        known = set(self.cache) | self.rendering | set(self.subscribers)
+        touched = set()
+        for z in {key[0] for key in known}:
+            n = 2**z
+            # Запас меньше тайла, поэтому точка задевает не больше четырёх
+            # тайлов: сочетания краёв её окрестности по x и по y
+            xs = [np.floor(mx * n - self.margin), np.floor(mx * n + self.margin)]
+            ys = [np.floor(my * n - self.margin), np.floor(my * n + self.margin)]
+            pairs = np.unique(
+                np.concatenate(
+                    [np.stack([tx, ty], axis=1) for tx in xs for ty in ys]
+                ).astype(np.int64),
+                axis=0,
+            )
+            tiles = {(z, x, y) for x, y in pairs.tolist()}
+            touched.update(tiles & known)
+
+        for key in touched:
+            self.versions[key] = self.versions.get(key, 0) + 1
+            self.dropCached(key)
+
+        # Подписанные тайлы, которые не строятся сейчас, перестраиваем сразу;
+        # строящиеся перестроятся после получения устаревшего результата
+        for key in touched:
+            if self.subscribers.get(key) and key not in self.rendering:
+                self.renderTile(key)
+
+        if touched:
+            self.tilesInvalidated.emit(sorted(touched))
+
+    def requestTile(self, view, z, x, y):
+        """
+        Возвращает QPixmap из кэша (null, если в тайле нет точек) или None,
+        если тайл ещё строится; тогда результат придёт в handleLayerTileLoaded.
+        """
+        key = (z, x, y)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            return entry[0]
+
+        self.subscribers.setdefault(key, weakref.WeakSet()).add(view)
+        if key not in self.rendering:
+            self.renderTile(key)
+        return None
+
+    def cancelRequests(self, view):
+        for key in list(self.subscribers):
+            views = self.subscribers[key]
+            views.discard(view)
+            if not views:
+                del self.subscribers[key]
+
+    def cancelTile(self, view, z, x, y):
+        views = self.subscribers.get((z, x, y))
+        if views is None:
+            return
+        views.discard(view)
+        if not views:
+            del self.subscribers[(z, x, y)]
+
+    def renderTile(self, key):
+        self.rendering.add(key)
+        task = HeatmapRenderTask(
+            self.mx,
+            self.my,
+            key,
+            self.versions.get(key, 0),
+            self.params,
+            self.render_signals,
+        )
+        self.render_pool.start(task)
+
+    def handleTileRendered(self, key, version, image):
+        self.rendering.discard(key)
+        if version != self.versions.get(key, 0):
+            # Пока тайл строился, добавились точки
+            if self.subscribers.get(key):
+                self.renderTile(key)
+            return
+
+        pixmap = QPixmap() if image.isNull() else QPixmap.fromImage(image)
+        size = pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        self.dropCached(key)
+        self.cache[key] = (pixmap, size)
+        self.cache_size += size
+        while len(self.cache) > 1 and (
+            self.cache_size > self.cache_bytes
+            or len(self.cache) > self.max_cached_tiles
+        ):
+            self.dropCached(next(iter(self.cache)))
+
+        for view in self.subscribers.pop(key, ()):
+            if shiboken6.isValid(view):
+                view.handleLayerTileLoaded(self, *key, pixmap)
+
+    def dropCached(self, key):
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.cache_size -= entry[1]
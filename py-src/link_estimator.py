@@ -0,0 +1,138 @@
+import time
+
+
+class LinkEstimator:
+    """
+    Оценка канала по завершённым загрузкам тайлов.
+
+    RTT сглаживается как в TCP (RFC 6298), по нему считается таймаут запроса.
+    Число одновременных запросов растёт на единицу после каждого успешного
+    ответа и уменьшается вдвое при таймауте. quality() говорит, на сколько
+    уровней зума грубее стоит сначала загрузить видимую область.
+
+    Скорость канала - суммарные байты всех запросов за окно window секунд.
+    Окно учитывается, только если в нём в среднем было не меньше
+    min_concurrency запросов одновременно: скорость одного маленького тайла
+    определяется задержкой, а не пропускной способностью.
+    """
+
+    def __init__(
+        self,
+        min_timeout=1000,
+        max_timeout=30000,
+        min_concurrency=4,
+        max_concurrency=64,
+        window=2.0,
+    ):
+        self.min_timeout = min_timeout  # мс
+        self.max_timeout = max_timeout  # мс
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+
+        # Пороги плохого и очень плохого канала: RTT в мс и байты в секунду
+        self.poor_rtt = 800
+        self.bad_rtt = 2000
+        self.poor_throughput = 200 * 1024
+        self.bad_throughput = 50 * 1024
+
+        self.window = window  # с
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.busy_time = 0.0  # Интеграл числа запросов по времени в окне
+        self.last_change = self.window_start
+        self.in_flight = 0
+
+        self.srtt = None  # Сглаженный RTT, мс
+        self.rttvar = None  # Разброс RTT, мс
+        self.throughput = None  # Сглаженная суммарная скорость, байт/с
+        self.backoff = 1  # Множитель таймаута после таймаутов подряд
+        self.concurrency = min_concurrency * 2
+
+    def requestStarted(self):
+        self.advance()
+        self.in_flight += 1
+
+    def requestFinished(self, size=0):
+        """Запрос завершён (успешно или нет), получено size байт"""
+        self.advance()
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.window_bytes += size
+
+    def advance(self):
+        now = time.monotonic()
+        self.busy_time += self.in_flight * (now - self.last_change)
+        self.last_change = now
+
+        duration = now - self.window_start
+        if duration < self.window:
+            return
+
+        if self.busy_time / duration >= self.min_concurrency:
+            rate = self.window_bytes / duration
+            if self.throughput is None:
+                self.throughput = rate
+            else:
+                self.throughput = 0.7 * self.throughput + 0.3 * rate
+
+        self.window_start = now
+        self.window_bytes = 0
+        self.busy_time = 0.0
+
+    def addSample(self, elapsed):
+        """Учитывает успешный ответ за elapsed мс"""
+        elapsed = max(elapsed, 1.0)
+        if self.srtt is None:
+            self.srtt = elapsed
+            self.rttvar = elapsed / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - elapsed)
+            self.srtt = 0.875 * self.srtt + 0.125 * elapsed
+
+        self.backoff = 1
+        self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+
+    def addTimeout(self):
+        self.backoff = min(self.backoff * 2, 8)
+        self.concurrency = max(self.concurrency // 2, self.min_concurrency)
+
+    def timeout(self):
+        """Таймаут следующего запроса в мс"""
+        if self.srtt is None:
+            timeout = 5000
+        else:
+            # Не меньше двух RTT: при ровном канале rttvar почти нулевой
+            timeout = max(self.srtt + 4 * self.rttvar, 2 * self.srtt)
+        timeout *= self.backoff
+        return int(min(max(timeout, self.min_timeout), self.max_timeout))
+
+    def quality(self):
+        """
+        0 - канал хороший, 1 - плохой (сначала тайлы на уровень грубее,
+        в 4 раза меньше запросов), 2 - очень плохой (на два уровня, в 16 раз).
+        """
+        # Таймауты без единого успешного ответа - тоже плохой канал
+        level = 1 if self.backoff > 1 else 0
+        if self.srtt is None:
+            return level
+
+        # Скорость неизвестна, пока не было окна с достаточной нагрузкой
+        throughput = self.throughput
+        if self.srtt > self.bad_rtt or (
+            throughput is not None and throughput < self.bad_throughput
+        ):
+            return 2
+        if self.srtt > self.poor_rtt or (
+            throughput is not None and throughput < self.poor_throughput
+        ):
+            return 1
+        return level
+
+    def stats(self):
+        return {
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "throughput": self.throughput,
+            "concurrency": self.concurrency,
+            "timeout": self.timeout(),
+            "quality": self.quality(),
+        }
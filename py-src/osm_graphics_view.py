@@ -3,10 +3,8 @@ import math
 
 from searchwidget import SearchWidget
 
-from functools import partial
-from PySide6.QtCore import QUrl
-from PySide6.QtGui import QPixmap, QPainter
-from PySide6.QtNetwork import QNetworkRequest, QNetworkReply
+from PySide6.QtCore import Qt, QPointF, QEvent
+from PySide6.QtGui import QPixmap, QPainter, QTransform
 from PySide6.QtWidgets import (
     QGraphicsView,
     QGraphicsScene,
@@ -14,7 +12,8 @@ from PySide6.QtWidgets import (
     QPushButton,
 )
 
-from network_access_manager_pool import NetworkAccessManagerPool
+from tile_service import TileService
+from zoom_transition import ZoomTransition
 
 
 def check_and_extract_numbers(filename):
@@ -47,20 +46,43 @@ class OSMGraphicsView(QGraphicsView):
         self.setCacheMode(QGraphicsView.CacheNone)
 
         self.tile_size = 256  # Размер одного тайла в пикселях
-        self.zoom = zoom  # Текущий уровень зума
-        self.tiles = {}  # Загруженные тайлы: ключ (zoom, x, y, world_offset)
-        self._fade_anim_group = None  # Ссылка на группу анимаций fade-out
+        self.zoom = zoom  # Текущий уровень зума тайлов (целый)
+        self.zoom_level = float(zoom)  # Непрерывный уровень зума вида
+        # Запас сверх половины уровня, после которого меняется уровень тайлов
+        self.zoom_hysteresis = 0.15
+        # Сколько тайлов за краем видимой области остаются на сцене; дальние
+        # убираются, их изображения остаются в кэше TileService
+        self.tile_keep_margin = 2
+        self.tiles = {}  # Размещённые тайлы: ключ (zoom, x, y, world_offset)
+        # Загружаемые тайлы: ключ (zoom, x, y) -> множество world_offset
+        self.pending_tiles = {}
+        # Грубые тайлы для медленного канала: ключ (zoom, x, y) -> ключи
+        # тайлов текущего уровня, которые они временно заменяют
+        self.coarse_tiles = {}
+        # Загруженные тайлы прежних уровней, увеличенные до текущего: лежат под
+        # тайлами текущего уровня, пока те загружаются
+        self.fallback_tiles = []
+        self.max_fallback_levels = 2
+        # Слои поверх карты (например, HeatmapLayer): слой -> (размещённые,
+        # загружаемые) тайлы слоя с теми же ключами, что tiles и pending_tiles
+        self.overlays = {}
+
+        self.preview_pixmap = QPixmap("../data/preview.png")
 
         self.scene = QGraphicsScene(self)
         self.setScene(self.scene)
         self.updateSceneRect()
 
-        # Предполагается, что NetworkAccessManagerPool определён
-        self.network_manager_pool = NetworkAccessManagerPool(self, 100)
+        # Общий для всех видов сервис: кэш, сеть и декодирование тайлов
+        self.tile_service = TileService.instance()
 
         # Начальная загрузка тайлов
         self.updateTiles()
 
+        # Анимация перехода между уровнями зума по снимку viewport
+        self.zoomTransition = ZoomTransition(self)
+        self.zoomTransition.zoomCommitted.connect(self.setZoomLevel)
+
         self.h_margin = 20
         self.w_margin = 20
 
@@ -98,6 +120,8 @@ class OSMGraphicsView(QGraphicsView):
 
         # Найдем уровень зума, который поместит всю область в экран
         self.zoom = self.calculateBestZoom(south, north, west, east)
+        self.zoom_level = float(self.zoom)
+        self.resetTransform()
         self.updateSceneRect()
 
         # Переведем центр в пиксельные координаты
@@ -209,6 +233,9 @@ class OSMGraphicsView(QGraphicsView):
         y_min = int(rect.top() // self.tile_size)
         y_max = int(rect.bottom() // self.tile_size) + 1
         n_tiles = 2**self.zoom
+        placed = set()
+
+        self.pruneTiles(x_min, x_max, y_min, y_max)
 
         for x in range(x_min, x_max + 1):
             wrapped_x = x % n_tiles
@@ -217,112 +244,356 @@ class OSMGraphicsView(QGraphicsView):
                 if y < 0 or y >= n_tiles:
                     continue  # Вертикальное оборачивание не требуется
                 key = (self.zoom, wrapped_x, y, world_offset)
-                if key not in self.tiles:
-                    self.preLoadTile(wrapped_x, y, self.zoom, world_offset)
-                    self.loadTile(wrapped_x, y, self.zoom, world_offset)
-
-    def preLoadTile(self, x, y, z, world_offset):
-        pixmap = QPixmap()
-        pixmap.load("../data/preview.png")
-        if pixmap.isNull():
-            print(f"Не могу превью для ({z}/{x}/{y})")
-            return
+                for layer, (tiles, _) in self.overlays.items():
+                    if key not in tiles:
+                        self.placeTile(wrapped_x, y, self.zoom, world_offset, layer)
 
-        item = QGraphicsPixmapItem(pixmap)
-        # Позиционирование с учетом горизонтального оборачивания:
-        # (x + world_offset) учитывает повторения карты слева и справа.
-        item.setPos((x + world_offset) * self.tile_size, y * self.tile_size)
-        item.setZValue(1)
-        self.scene.addItem(item)
-        self.tiles[(z, x, y, world_offset)] = item
+                if key in self.tiles:
+                    continue
+                if self.tile_service.isFailed(self.zoom, wrapped_x, y):
+                    continue  # Недавно не загрузился - ждём истечения TTL
+                self.placeTile(wrapped_x, y, self.zoom, world_offset)
+                placed.add((self.zoom, wrapped_x, y))
+
+        levels = min(self.tile_service.progressiveLevels(), self.zoom)
+        if placed and levels:
+            self.loadCoarseTiles(placed, levels)
+
+        # Все видимые тайлы могли найтись в кэше
+        self.clearFallbackTiles()
 
-    def loadTile(self, x, y, z, world_offset=0):
+    def addOverlayLayer(self, layer):
         """
-        Формирование URL и запуск асинхронной загрузки тайла с учётом смещения.
+        Добавляет слой поверх тайлов карты. Слой отдаёт тайлы так же, как
+        TileService: requestTile(view, z, x, y) возвращает QPixmap или None,
+        и тогда тайл приходит позже в handleLayerTileLoaded; cancelTile
+        и cancelRequests снимают подписки. Тайлы слоя
+        размещаются и ждут загрузки тем же путём, что и тайлы карты.
         """
+        if layer in self.overlays:
+            return
+        self.overlays[layer] = ({}, {})
+        layer.tilesInvalidated.connect(self.handleLayerTilesInvalidated)
+        self.updateTiles()
 
-        url = f"http://localhost:8080/{z}/{x}/{y}.png"
+    def tileState(self, layer=None):
+        """Размещённые и загружаемые тайлы и источник тайлов слоя (None - карта)"""
+        if layer is None:
+            return self.tiles, self.pending_tiles, self.tile_service
+        tiles, pending = self.overlays[layer]
+        return tiles, pending, layer
 
-        request = QNetworkRequest(QUrl(url))
-        reply = self.network_manager_pool.getNetworkManager().get(request)
-        reply.finished.connect(
-            partial(self.handleTileReply, reply, x, y, z, world_offset)
-        )
+    def handleLayerTileLoaded(self, layer, z, x, y, pixmap):
+        if layer in self.overlays:
+            self.setLoadedTile(z, x, y, pixmap, layer)
 
-    def handleTileReply(self, reply, x, y, z, world_offset):
+    def handleLayerTilesInvalidated(self, tile_keys):
         """
-        Обработка ответа и добавление тайла на сцену.
-        Если уровень зума уже изменился, ответ игнорируется.
+        Слой пересчитал часть тайлов: размещённые тайлы запрашиваются снова,
+        а старое изображение остаётся на сцене до прихода нового.
         """
-        if z != self.zoom:
-            reply.deleteLater()
+        layer = self.sender()
+        if layer not in self.overlays:
             return
 
-        err = reply.error()
-        if err != QNetworkReply.NetworkError.NoError:
-            print(
-                f"Error: {err} Ошибка загрузки тайла {z}/{x}/{y}: {reply.errorString()}"
+        tiles, pending, _ = self.tileState(layer)
+        for z, x, y in tile_keys:
+            if z != self.zoom:
+                continue
+            offsets = pending.get((z, x, y), set())
+            offsets |= {key[3] for key in tiles if key[:3] == (z, x, y)}
+            if not offsets:
+                continue
+
+            pending[(z, x, y)] = offsets
+            pixmap = layer.requestTile(self, z, x, y)
+            if pixmap is not None:
+                self.setLoadedTile(z, x, y, pixmap, layer)
+
+    def pruneTiles(self, x_min, x_max, y_min, y_max):
+        """
+        Убирает со сцены тайлы и тайлы слоёв дальше tile_keep_margin от
+        видимой области, чтобы сцена не держала QPixmap всех просмотренных
+        тайлов. При возврате к ним тайлы берутся из кэша TileService.
+        Ещё не загруженные тайлы снимаются с очереди, чтобы после быстрой
+        прокрутки не загружать ушедшие из вида тайлы раньше видимых.
+        """
+        margin = self.tile_keep_margin
+
+        def is_far(x, y, world_offset):
+            return not (
+                x_min - margin <= x + world_offset <= x_max + margin
+                and y_min - margin <= y <= y_max + margin
+            )
+
+        for layer in [None, *self.overlays]:
+            tiles, pending, source = self.tileState(layer)
+            for key in [key for key in tiles if is_far(*key[1:])]:
+                z, x, y, world_offset = key
+                self.scene.removeItem(tiles.pop(key))
+                offsets = pending.get((z, x, y))
+                if offsets is None:
+                    continue
+                offsets.discard(world_offset)
+                if not offsets:
+                    # Ни одна копия тайла больше не ждёт - запрос не нужен
+                    del pending[(z, x, y)]
+                    source.cancelTile(self, z, x, y)
+
+    def placeTile(self, x, y, z, world_offset, layer=None):
+        """
+        Размещает копию тайла (z, x, y) карты или слоя layer со смещением
+        world_offset. Все копии мира используют один QPixmap и один запрос:
+        пока тайл загружается, копии показывают превью и ждут в pending_tiles
+        (у слоя - в его словаре загружаемых тайлов).
+        """
+        _, pending, source = self.tileState(layer)
+        tile_key = (z, x, y)
+        offsets = pending.get(tile_key)
+        if offsets is None:
+            pixmap = source.requestTile(self, z, x, y)
+            if pixmap is not None:
+                self.addTileItem(pixmap, x, y, z, world_offset, layer)
+                return
+            offsets = pending[tile_key] = set()
+
+        self.preLoadTile(x, y, z, world_offset, layer)
+        offsets.add(world_offset)
+
+    def loadCoarseTiles(self, tile_keys, levels):
+        """
+        На медленном канале сначала загружает тайлы на levels уровней грубее:
+        один такой тайл покрывает 4**levels тайлов текущего уровня, и его
+        запрос ставится в начало очереди. Пока полные тайлы не пришли,
+        вместо превью показывается увеличенная часть грубого тайла.
+        """
+        parents = {}
+        for z, x, y in tile_keys:
+            if (z, x, y) in self.pending_tiles:
+                parent_key = (z - levels, x >> levels, y >> levels)
+                parents.setdefault(parent_key, set()).add((z, x, y))
+
+        for parent_key, children in parents.items():
+            waiting = self.coarse_tiles.get(parent_key)
+            if waiting is not None:
+                waiting.update(children)
+                continue
+
+            if self.tile_service.isFailed(*parent_key):
+                continue  # Запрос не будет отправлен, ждать нечего
+
+            pixmap = self.tile_service.requestTile(self, *parent_key, front=True)
+            if pixmap is not None:
+                self.applyCoarseTile(parent_key, children, pixmap)
+            else:
+                self.coarse_tiles[parent_key] = children
+
+    def applyCoarseTile(self, parent_key, children, pixmap):
+        pz, px, py = parent_key
+        for z, x, y in children:
+            offsets = self.pending_tiles.get((z, x, y))
+            if z != self.zoom or not offsets:
+                continue  # Полный тайл уже загружен
+
+            levels = z - pz
+            size = pixmap.width() >> levels
+            part = pixmap.copy(
+                (x - (px << levels)) * size, (y - (py << levels)) * size, size, size
+            ).scaled(
+                self.tile_size,
+                self.tile_size,
+                Qt.IgnoreAspectRatio,
+                Qt.SmoothTransformation,
             )
-            reply.deleteLater()
+            for world_offset in offsets:
+                item = self.tiles.get((z, x, y, world_offset))
+                if item is not None:
+                    item.setPixmap(part)
+
+    def preLoadTile(self, x, y, z, world_offset, layer=None):
+        if layer is not None:
+            # Тайл слоя до загрузки прозрачен
+            self.addTileItem(QPixmap(), x, y, z, world_offset, layer)
+            return
+
+        if self.fallback_tiles:
+            # Под тайлом видны увеличенные тайлы прежнего уровня
+            self.addTileItem(QPixmap(), x, y, z, world_offset)
             return
 
-        data = reply.readAll()
-        pixmap = QPixmap()
-        pixmap.loadFromData(data)
-        if pixmap.isNull():
-            print(f"Не могу загрузить тайл ({z}/{x}/{y})")
-            reply.deleteLater()
+        if self.preview_pixmap.isNull():
+            print(f"Не могу превью для ({z}/{x}/{y})")
             return
 
+        self.addTileItem(self.preview_pixmap, x, y, z, world_offset)
+
+    def addTileItem(self, pixmap, x, y, z, world_offset, layer=None):
+        tiles, _, _ = self.tileState(layer)
         item = QGraphicsPixmapItem(pixmap)
         # Позиционирование с учетом горизонтального оборачивания:
         # (x + world_offset) учитывает повторения карты слева и справа.
         item.setPos((x + world_offset) * self.tile_size, y * self.tile_size)
-        item.setZValue(1)
+        # Слои рисуются поверх тайлов карты
+        item.setZValue(1 if layer is None else 2)
         self.scene.addItem(item)
-        self.tiles[(z, x, y, world_offset)] = item
+        tiles[(z, x, y, world_offset)] = item
 
-        reply.deleteLater()
+    def handleTileLoaded(self, z, x, y, pixmap):
+        """
+        Замена превью на загруженный тайл во всех ожидающих копиях мира.
+        Если уровень зума уже изменился, тайл игнорируется.
+        """
+        children = self.coarse_tiles.pop((z, x, y), None)
+        if children is not None:
+            self.applyCoarseTile((z, x, y), children, pixmap)
 
-    def wheelEvent(self, event):
+        self.setLoadedTile(z, x, y, pixmap)
+
+    def setLoadedTile(self, z, x, y, pixmap, layer=None):
+        tiles, pending, _ = self.tileState(layer)
+        offsets = pending.pop((z, x, y), None)
+        if offsets is None or z != self.zoom:
+            return
+
+        for world_offset in offsets:
+            item = tiles.get((z, x, y, world_offset))
+            if item is None:
+                self.addTileItem(pixmap, x, y, z, world_offset, layer)
+            else:
+                item.setPixmap(pixmap)
+
+        if layer is None:
+            self.clearFallbackTiles()
+
+    def handleTileFailed(self, z, x, y):
         """
-        При изменении зума:
-          - Старые тайлы сохраняются для плавного исчезновения (fade-out).
-          - Вычисляется новый уровень зума, обновляются размеры сцены и центр.
-          - После загрузки новых тайлов для нового зума, старые плавно исчезают.
+        Тайл не загрузился: превью убирается со сцены, чтобы тайл был
+        запрошен снова, когда сервис перестанет считать его неудачным.
         """
+        self.coarse_tiles.pop((z, x, y), None)
+        offsets = self.pending_tiles.pop((z, x, y), None)
+        if offsets is None or z != self.zoom:
+            return
 
-        visibleRect = self.mapToScene(self.viewport().rect()).boundingRect()
-        sceneRect = self.scene.sceneRect()
+        for world_offset in offsets:
+            item = self.tiles.pop((z, x, y, world_offset), None)
+            if item is not None:
+                self.scene.removeItem(item)
 
-        if visibleRect.width() >= sceneRect.width():
-            self.scene.clear()
-            self.scene.setSceneRect(visibleRect)
+        self.clearFallbackTiles()
 
+    def wheelEvent(self, event):
+        """
+        Щелчки колеса мыши накапливаются в анимированном переходе между целыми
+        уровнями. Тачпад присылает мелкие приращения - они меняют зум непрерывно.
+        """
         delta = event.angleDelta().y()
-        old_zoom = self.zoom
-        if delta > 0:
-            new_zoom = min(self.zoom + 1, 19)
-        else:
-            new_zoom = max(self.zoom - 1, 0)
-        if new_zoom == old_zoom:
+        if delta == 0:
             return
 
-        # Сохраняем старые тайлы и очищаем словарь для новых
-        old_items = list(self.tiles.values())
-        self.tiles.clear()
+        if event.pixelDelta().isNull() and delta % 120 == 0:
+            self.zoomTransition.addSteps(delta // 120, event.position())
+        elif not self.zoomTransition.isRunning():
+            # 120 единиц соответствуют одному щелчку колеса, т.е. половине уровня
+            self.zoomBy(delta / 240, event.position())
 
-        # Вычисляем новую позицию центра
-        cursor_scene_pos = self.mapToScene(event.position().toPoint())
-        factor = pow(2, new_zoom - old_zoom)
-        new_center = cursor_scene_pos * factor
+    def viewportEvent(self, event):
+        # Жест масштабирования (pinch) на тачпаде
+        if (
+            event.type() == QEvent.NativeGesture
+            and event.gestureType() == Qt.ZoomNativeGesture
+        ):
+            if 1.0 + event.value() > 0 and not self.zoomTransition.isRunning():
+                self.zoomBy(math.log2(1.0 + event.value()), event.position())
+            return True
 
-        self.zoom = new_zoom
-        self.updateSceneRect()
-        self.centerOn(new_center)
+        return super().viewportEvent(event)
+
+    def zoomBy(self, levels, anchor):
+        self.setZoomLevel(self.zoom_level + levels, anchor)
+
+    def selectTileZoom(self, level):
+        """
+        Выбирает уровень тайлов для непрерывного зума level с гистерезисом:
+        текущий уровень сохраняется, пока level отходит от него не дальше
+        чем на половину уровня плюс zoom_hysteresis.
+        """
+        if abs(level - self.zoom) <= 0.5 + self.zoom_hysteresis:
+            return self.zoom
+
+        return min(max(int(round(level)), 0), 19)
+
+    def setZoomLevel(self, level, anchor):
+        """
+        Устанавливает непрерывный уровень зума так, чтобы точка сцены под anchor
+        (координаты viewport) осталась на месте. Дробная часть зума задаётся
+        масштабом вида; тайлы перезагружаются только при смене целого уровня.
+        Загруженные тайлы прежнего уровня остаются под новыми (keepFallbackTiles),
+        поэтому при непрерывном зуме вид не сменяется превью.
+        """
+        level = min(max(level, 0.0), 19.0)
+        if level == self.zoom_level:
+            return
+
+        anchor_scene_pos = self.mapToScene(anchor.toPoint())
+        viewport_center = QPointF(self.viewport().rect().center())
+
+        new_zoom = self.selectTileZoom(level)
+        if new_zoom != self.zoom:
+            self.keepFallbackTiles(pow(2, new_zoom - self.zoom))
+            self.tiles.clear()
+            self.pending_tiles.clear()
+            self.coarse_tiles.clear()
+            self.tile_service.cancelRequests(self)
+            for layer, (tiles, pending) in self.overlays.items():
+                self.cleanupOldTiles(tiles.values())
+                tiles.clear()
+                pending.clear()
+                layer.cancelRequests(self)
+
+            anchor_scene_pos *= pow(2, new_zoom - self.zoom)
+            self.zoom = new_zoom
+            self.updateSceneRect()
+
+            print(f"ZOOM: {self.zoom}")
+
+        self.zoom_level = level
+        scale = pow(2, level - self.zoom)
+        self.setTransform(QTransform.fromScale(scale, scale))
+
+        # Вычисляем новую позицию центра
+        self.centerOn(anchor_scene_pos + (viewport_center - anchor) / scale)
         self.updateTiles()
 
-        print(f"ZOOM: {self.zoom}")
+    def keepFallbackTiles(self, factor):
+        """
+        Перед сменой уровня тайлов переводит загруженные тайлы в запасные:
+        они масштабируются в factor раз под сцену нового уровня и рисуются
+        под его тайлами, а превью новых тайлов прозрачны. Запасные тайлы
+        старше max_fallback_levels уровней удаляются.
+        """
+        for key, item in self.tiles.items():
+            if key[:3] in self.pending_tiles:
+                self.scene.removeItem(item)  # Превью или часть грубого тайла
+            else:
+                self.fallback_tiles.append(item)
+
+        kept = []
+        for item in self.fallback_tiles:
+            item.setPos(item.pos() * factor)
+            item.setScale(item.scale() * factor)
+            item.setZValue(0)
+            if abs(math.log2(item.scale())) > self.max_fallback_levels:
+                self.scene.removeItem(item)
+            else:
+                kept.append(item)
+        self.fallback_tiles = kept
+
+    def clearFallbackTiles(self):
+        """Убирает запасные тайлы, когда тайлы текущего уровня загружены"""
+        if self.fallback_tiles and not self.pending_tiles:
+            self.cleanupOldTiles(self.fallback_tiles)
+            self.fallback_tiles = []
 
     def cleanupOldTiles(self, items):
         for item in items:
@@ -340,58 +611,12 @@ class OSMGraphicsView(QGraphicsView):
         self.updateTiles()
 
     def upZoomEvent(self):
-
-        new_zoom = self.zoom + 1
-        old_zoom = self.zoom
-
-        if new_zoom > 19 or new_zoom < 0:
-            return
-
-        visibleRect = self.mapToScene(self.viewport().rect()).boundingRect()
-        sceneRect = self.scene.sceneRect()
-
-        if visibleRect.width() >= sceneRect.width():
-            self.scene.clear()
-            self.scene.setSceneRect(visibleRect)
-
-        self.tiles.clear()
-
-        # Вычисляем новую позицию центра
-        cursor_scene_pos = visibleRect.center().toPoint()
-        factor = pow(2, new_zoom - old_zoom)
-        new_center = cursor_scene_pos * factor
-
-        self.zoom = new_zoom
-        self.updateSceneRect()
-        self.centerOn(new_center)
-        self.updateTiles()
+        center = QPointF(self.viewport().rect().center())
+        self.zoomTransition.addSteps(1, center)
 
     def downZoomEvent(self):
-
-        new_zoom = self.zoom - 1
-        old_zoom = self.zoom
-
-        if new_zoom > 19 or new_zoom < 0:
-            return
-
-        visibleRect = self.mapToScene(self.viewport().rect()).boundingRect()
-        sceneRect = self.scene.sceneRect()
-
-        if visibleRect.width() >= sceneRect.width():
-            self.scene.clear()
-            self.scene.setSceneRect(visibleRect)
-
-        self.tiles.clear()
-
-        # Вычисляем новую позицию центра
-        cursor_scene_pos = visibleRect.center().toPoint()
-        factor = pow(2, new_zoom - old_zoom)
-        new_center = cursor_scene_pos * factor
-
-        self.zoom = new_zoom
-        self.updateSceneRect()
-        self.centerOn(new_center)
-        self.updateTiles()
+        center = QPointF(self.viewport().rect().center())
+        self.zoomTransition.addSteps(-1, center)
 
     def isNearMapBoundary(self, margin=50):
         # Получаем видимую область в координатах сцены
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+
+
+class TileMemoryCache:
+    """
+    Двухуровневый кэш тайлов в памяти.
+
+    Тёплый уровень хранит исходные сжатые байты (PNG/WebP, обычно 10-20 КБ)
+    для большого числа тайлов в пределах warm_bytes. Горячий уровень хранит
+    декодированные изображения (256 КБ у тайла 256 x 256 при 32 бит/пиксель)
+    в пределах hot_bytes - в основном тайлы видимой области.
+
+    Оба уровня адресуются по хэшу содержимого, поэтому одинаковые тайлы
+    хранятся один раз. Горячий уровень - подмножество тёплого: вытеснение
+    из горячего уровня (понижение) только отбрасывает изображение, а тайл
+    можно снова декодировать из байтов (повышение) без запроса в сеть.
+    """
+
+    def __init__(
+        self, hot_bytes=64 * 1024**2, warm_bytes=128 * 1024**2, max_tiles=65536
+    ):
+        self.hot_budget = hot_bytes
+        self.warm_budget = warm_bytes
+        self.max_tiles = max_tiles
+
+        self.tiles = OrderedDict()  # LRU: (z, x, y) -> хэш содержимого
+        self.blobs = {}  # Хэш -> [сжатые байты, число ссылок из tiles]
+        self.images = OrderedDict()  # LRU: хэш -> (изображение, размер в байтах)
+        self.hot_size = 0
+        self.warm_size = 0
+
+        self.promotions = 0  # Декодирований из тёплого уровня
+        self.demotions = 0  # Изображений, вытесненных из горячего уровня
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def digest(self, key):
+        """Хэш содержимого тайла или None, если тайла нет в кэше"""
+        digest = self.tiles.get(key)
+        if digest is not None:
+            self.tiles.move_to_end(key)
+        return digest
+
+    def data(self, digest):
+        return self.blobs[digest][0]
+
+    def image(self, digest):
+        """Декодированное изображение или None, если оно в тёплом уровне"""
+        entry = self.images.get(digest)
+        if entry is None:
+            return None
+        self.images.move_to_end(digest)
+        return entry[0]
+
+    def put(self, key, digest, data):
+        old_digest = self.tiles.pop(key, None)
+        if old_digest is not None:
+            self.releaseBlob(old_digest)
+
+        blob = self.blobs.get(digest)
+        if blob is None:
+            blob = self.blobs[digest] = [data, 0]
+            self.warm_size += len(data)
+        blob[1] += 1
+        self.tiles[key] = digest
+
+        while len(self.tiles) > 1 and (
+            self.warm_size > self.warm_budget or len(self.tiles) > self.max_tiles
+        ):
+            _, evicted_digest = self.tiles.popitem(last=False)
+            self.releaseBlob(evicted_digest)
+
+    def discard(self, key):
+        digest = self.tiles.pop(key, None)
+        if digest is not None:
+            self.releaseBlob(digest)
+
+    def addImage(self, digest, image, size, promoted=False):
+        """
+        Помещает декодированное изображение в горячий уровень, понижая
+        давно не использованные. promoted - изображение декодировано
+        из тёплого уровня. Если байтов тайла уже нет в тёплом уровне,
+        изображение не сохраняется.
+        """
+        if digest not in self.blobs or digest in self.images:
+            return
+
+        if promoted:
+            self.promotions += 1
+        self.images[digest] = (image, size)
+        self.hot_size += size
+        while len(self.images) > 1 and self.hot_size > self.hot_budget:
+            self.dropImage(next(iter(self.images)))
+            self.demotions += 1
+
+    def dropImage(self, digest):
+        entry = self.images.pop(digest, None)
+        if entry is not None:
+            self.hot_size -= entry[1]
+
+    def releaseBlob(self, digest):
+        blob = self.blobs[digest]
+        blob[1] -= 1
+        if blob[1] <= 0:
+            del self.blobs[digest]
+            self.warm_size -= len(blob[0])
+            self.dropImage(digest)
+
+    def stats(self):
+        return {
+            "tiles": len(self.tiles),
+            "warm_blobs": len(self.blobs),
+            "warm_bytes": self.warm_size,
+            "hot_images": len(self.images),
+            "hot_bytes": self.hot_size,
+            "promotions": self.promotions,
+            "demotions": self.demotions,
+        }
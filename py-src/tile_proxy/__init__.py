@@ -0,0 +1,5 @@
+from .metatile import pack_metatile, unpack_metatile
+from .png import is_valid_png
+from .server import TileProxy
+from .stores import MemoryStore, DiskStore, RedisStore, MBTilesStore, open_store
+from .upstream import UpstreamPool
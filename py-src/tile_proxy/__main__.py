@@ -0,0 +1,56 @@
+import argparse
+import asyncio
+
+from .server import TileProxy
+from .stores import open_store
+from .upstream import UpstreamPool
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python -m tile_proxy",
+        description="Локальный прокси тайлов OSM со схемой /{z}/{x}/{y}.png",
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--store",
+        choices=["memory", "disk", "redis", "mbtiles"],
+        default="memory",
+        help="Хранилище тайлов",
+    )
+    parser.add_argument(
+        "--store-path",
+        help="Каталог (disk), URL Redis (redis) или файл .mbtiles (mbtiles)",
+    )
+    parser.add_argument(
+        "--upstream",
+        action="append",
+        help="Шаблон URL upstream с {z}, {x}, {y}; можно указать несколько раз",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=8,
+        help="Максимум соединений к одному хосту upstream",
+    )
+    parser.add_argument("--timeout", type=float, default=10.0)
+    return parser.parse_args()
+
+
+async def main(args):
+    store = open_store(args.store, args.store_path)
+    upstream = UpstreamPool(args.upstream, args.connections, args.timeout)
+    proxy = TileProxy(store, upstream)
+    try:
+        await proxy.serve(args.host, args.port)
+    finally:
+        await upstream.close()
+        await store.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import random as rnd
+import time
+
+from urllib.parse import urlsplit
+
+from .protocol import read_head, read_body
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python -m tile_proxy.bench",
+        description="Нагрузочный тест сервера тайлов по keep-alive соединениям",
+    )
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--zoom", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--metatile",
+        type=int,
+        default=0,
+        help="Запрашивать метатайлы n x n вместо отдельных тайлов",
+    )
+    return parser.parse_args()
+
+
+async def worker(host, port, paths, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while paths:
+            path = paths.pop()
+            request = (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host}\r\n"
+                "Connection: keep-alive\r\n"
+                "\r\n"
+            )
+
+            started = time.perf_counter()
+            writer.write(request.encode("latin-1"))
+            await writer.drain()
+            status_line, headers = await read_head(reader)
+            await read_body(reader, headers)
+            latencies.append(time.perf_counter() - started)
+
+            status = int(status_line.split(" ", 2)[1])
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def main(args):
+    parts = urlsplit(args.url)
+    host, port = parts.hostname, parts.port or 80
+
+    rnd.seed(args.seed)
+    n = 2**args.zoom
+    if args.metatile:
+        template = f"/meta/{args.metatile}/{{z}}/{{x}}/{{y}}.bin"
+    else:
+        template = "/{z}/{x}/{y}.png"
+    paths = [
+        template.format(z=args.zoom, x=rnd.randrange(n), y=rnd.randrange(n))
+        for _ in range(args.requests)
+    ]
+
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            worker(host, port, paths, latencies, statuses)
+            for _ in range(args.connections)
+        )
+    )
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    print(f"Запросов: {len(latencies)} за {elapsed:.2f} с")
+    print(f"RPS: {len(latencies) / elapsed:.0f}")
+    print(
+        f"Задержка, мс: p50={percentile(0.5):.2f} "
+        f"p90={percentile(0.9):.2f} p99={percentile(0.99):.2f}"
+    )
+    print(f"Статусы: {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,82 @@
+import math
+import struct
+
+META_MAGIC = b"META"
+META_HEADER = struct.Struct("<iiii")  # count, x, y, z
+META_ENTRY = struct.Struct("<ii")  # offset, size
+MAX_METATILE_SIZE = 16
+# Размер записи тайла, который не загрузился из-за временной ошибки upstream;
+# в отличие от нулевого размера (тайла нет) его стоит запросить снова
+META_FAILED = -1
+
+
+def metatile_origin(x, y, n):
+    """Левый верхний тайл метатайла n x n, содержащего тайл (x, y)"""
+    return x - x % n, y - y % n
+
+
+def pack_metatile(z, x, y, n, tiles, failed=()):
+    """
+    Упаковывает тайлы блока n x n с началом (x, y) в один ответ.
+
+    Формат как у метатайлов mod_tile: b"META", затем count, x, y, z (int32 LE),
+    затем count пар (offset, size) и содержимое тайлов. Тайл (tx, ty) имеет
+    индекс (tx - x) * n + (ty - y); отсутствующие тайлы записываются
+    с нулевым размером, а тайлы из failed - с размером META_FAILED.
+    tiles - словарь (x, y) -> содержимое.
+    """
+    count = n * n
+    offset = len(META_MAGIC) + META_HEADER.size + META_ENTRY.size * count
+
+    index = []
+    chunks = []
+    for i in range(n):
+        for j in range(n):
+            if (x + i, y + j) in failed:
+                index.append(META_ENTRY.pack(offset, META_FAILED))
+                chunks.append(b"")
+                continue
+            data = tiles.get((x + i, y + j)) or b""
+            index.append(META_ENTRY.pack(offset, len(data)))
+            chunks.append(data)
+            offset += len(data)
+
+    return (
+        META_MAGIC
+        + META_HEADER.pack(count, x, y, z)
+        + b"".join(index)
+        + b"".join(chunks)
+    )
+
+
+def unpack_metatile(data):
+    """
+    Разбирает ответ pack_metatile. Возвращает (z, tiles, failed), где
+    tiles - словарь (x, y) -> содержимое только для непустых тайлов,
+    failed - множество (x, y) тайлов с временной ошибкой.
+    При повреждённых данных бросает ValueError.
+    """
+    header_end = len(META_MAGIC) + META_HEADER.size
+    if len(data) < header_end or not data.startswith(META_MAGIC):
+        raise ValueError("Нет заголовка метатайла")
+
+    count, x, y, z = META_HEADER.unpack_from(data, len(META_MAGIC))
+    n = math.isqrt(max(count, 0))
+    if n * n != count or header_end + META_ENTRY.size * count > len(data):
+        raise ValueError("Повреждённый индекс метатайла")
+
+    tiles = {}
+    failed = set()
+    for index in range(count):
+        entry_offset = header_end + META_ENTRY.size * index
+        offset, size = META_ENTRY.unpack_from(data, entry_offset)
+        if size == META_FAILED:
+            failed.add((x + index // n, y + index % n))
+            continue
+        if size == 0:
+            continue
+        if offset < 0 or size < 0 or offset + size > len(data):
+            raise ValueError("Тайл выходит за границы метатайла")
+        tiles[(x + index // n, y + index % n)] = data[offset : offset + size]
+
+    return z, tiles, failed
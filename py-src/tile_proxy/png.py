@@ -0,0 +1,27 @@
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_IEND = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def is_valid_png(data):
+    """
+    Дешёвая проверка PNG без декодирования изображения: сигнатура,
+    первый чанк IHDR с корректной CRC и завершающий чанк IEND.
+    Отсекает обрезанные ответы и HTML-страницы ошибок вместо тайлов.
+    """
+    if len(data) < len(PNG_SIGNATURE) + 25 + len(PNG_IEND):
+        return False
+    if not data.startswith(PNG_SIGNATURE):
+        return False
+
+    length, chunk_type = struct.unpack(">I4s", data[8:16])
+    if chunk_type != b"IHDR" or length != 13:
+        return False
+
+    (crc,) = struct.unpack(">I", data[29:33])
+    if zlib.crc32(data[12:29]) != crc:
+        return False
+
+    return data.endswith(PNG_IEND)
@@ -0,0 +1,64 @@
+class ProtocolError(Exception):
+    pass
+
+
+MAX_HEADER_LINES = 100
+
+
+async def read_head(reader):
+    """
+    Читает стартовую строку и заголовки HTTP/1.1.
+    Возвращает (start_line, headers) или None, если соединение закрыто
+    до начала сообщения. Имена заголовков приводятся к нижнему регистру.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+
+    start_line = line.decode("latin-1").rstrip("\r\n")
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if not line:
+            raise ProtocolError("Соединение закрыто посреди заголовков")
+        if line in (b"\r\n", b"\n"):
+            return start_line, headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    raise ProtocolError("Слишком много заголовков")
+
+
+async def read_body(reader, headers, until_close=False):
+    """
+    Читает тело по Content-Length или chunked. Если длина не указана,
+    читает до закрытия соединения только при until_close (ответы сервера).
+    """
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                # Завершающие заголовки (trailer) пропускаем
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    length = headers.get("content-length")
+    if length is not None:
+        return await reader.readexactly(int(length))
+
+    if until_close:
+        return await reader.read()
+
+    return b""
+
+
+def keep_alive(version, headers):
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
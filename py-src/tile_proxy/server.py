@@ -0,0 +1,235 @@
+import asyncio
+import json
+import re
+
+from .metatile import MAX_METATILE_SIZE, metatile_origin, pack_metatile
+from .png import is_valid_png
+from .protocol import ProtocolError, read_head, read_body, keep_alive
+
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.png$")
+METATILE_PATH = re.compile(r"^/meta/(\d+)/(\d+)/(\d+)/(\d+)\.bin$")
+MAX_ZOOM = 19
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+ERROR_TEXT = {
+    404: b"Tile not found",
+    502: b"Upstream error",
+    503: b"Store unavailable",
+    504: b"Upstream timeout",
+}
+
+
+class TileProxy:
+    """
+    Асинхронный прокси тайлов с той же схемой URL, что и cmd/server:
+    GET /{z}/{x}/{y}.png. Тайлы берутся из хранилища, а при промахе -
+    с upstream; одновременные запросы одного тайла объединяются
+    в одну загрузку. GET /stats возвращает счётчики в JSON.
+
+    GET /meta/{n}/{z}/{x}/{y}.bin отдаёт одним ответом блок n x n тайлов,
+    содержащий тайл (x, y), в формате pack_metatile.
+    """
+
+    def __init__(self, store, upstream):
+        self.store = store
+        self.upstream = upstream
+        self.inflight = {}  # (z, x, y) -> asyncio.Future с (status, data)
+
+        self.counters = {
+            "requests": 0,
+            "metatiles": 0,
+            "store_hits": 0,
+            "upstream_fetches": 0,
+            "coalesced": 0,
+            "invalid": 0,
+            "errors": 0,
+        }
+
+    async def getTile(self, z, x, y):
+        """
+        Возвращает (status, data). data есть только при status 200;
+        404 - тайла нет у upstream или он не PNG, 502 и 504 - временная
+        ошибка upstream, 503 - хранилище недоступно.
+        """
+        try:
+            data = await self.store.get(z, x, y)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Ошибка чтения тайла {z}/{x}/{y} из хранилища: {e!r}")
+            return 503, None
+
+        if data is not None:
+            self.counters["store_hits"] += 1
+            return 200, data
+
+        key = (z, x, y)
+        future = self.inflight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        result = (502, None)
+        try:
+            result = await self.fetchTile(z, x, y)
+        finally:
+            # Ожидающие получают результат и при отмене этого запроса
+            del self.inflight[key]
+            future.set_result(result)
+
+        return result
+
+    async def fetchTile(self, z, x, y):
+        self.counters["upstream_fetches"] += 1
+        try:
+            status, body = await self.upstream.fetch(z, x, y)
+        except asyncio.TimeoutError:
+            self.counters["errors"] += 1
+            print(f"Таймаут загрузки тайла {z}/{x}/{y} с upstream")
+            return 504, None
+        except (OSError, ValueError, ProtocolError) as e:
+            self.counters["errors"] += 1
+            print(f"Ошибка загрузки тайла {z}/{x}/{y} с upstream: {e!r}")
+            return 502, None
+
+        if status in (404, 410):
+            self.counters["invalid"] += 1
+            return 404, None
+        if status != 200:
+            # 5xx, 429 и прочие ответы - временная ошибка, а не отсутствие тайла
+            self.counters["errors"] += 1
+            print(f"Upstream ответил {status} на тайл {z}/{x}/{y}")
+            return 502, None
+        if not is_valid_png(body):
+            self.counters["invalid"] += 1
+            return 404, None
+
+        try:
+            await self.store.put(z, x, y, body)
+        except Exception as e:
+            print(f"Ошибка записи тайла {z}/{x}/{y} в хранилище: {e!r}")
+
+        return 200, body
+
+    async def handleConnection(self, reader, writer):
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None:
+                    break
+
+                request_line, headers = head
+                parts = request_line.split(" ")
+                if len(parts) != 3:
+                    await self.respond(writer, 400, b"Bad request", close=True)
+                    break
+
+                method, path, version = parts
+                await read_body(reader, headers)
+                persistent = keep_alive(version, headers)
+
+                status, content_type, body = await self.route(method, path)
+                await self.respond(
+                    writer, status, body, content_type, close=not persistent
+                )
+                if not persistent:
+                    break
+        except (
+            ConnectionError,
+            ValueError,
+            ProtocolError,
+            asyncio.IncompleteReadError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path):
+        self.counters["requests"] += 1
+        if method != "GET":
+            return 405, "text/plain", b"Method not allowed"
+
+        if path == "/stats":
+            return 200, "application/json", json.dumps(self.stats()).encode()
+
+        path = path.split("?", 1)[0]
+        match = METATILE_PATH.match(path)
+        if match:
+            n, z, x, y = (int(v) for v in match.groups())
+            return await self.routeMetatile(n, z, x, y)
+
+        match = TILE_PATH.match(path)
+        if not match:
+            return 404, "text/plain", b"Not found"
+
+        z, x, y = (int(v) for v in match.groups())
+        if z > MAX_ZOOM or x >= (1 << z) or y >= (1 << z):
+            return 404, "text/plain", b"Tile out of range"
+
+        status, data = await self.getTile(z, x, y)
+        if data is None:
+            return status, "text/plain", ERROR_TEXT[status]
+
+        return 200, "image/png", data
+
+    async def routeMetatile(self, n, z, x, y):
+        if not 1 <= n <= MAX_METATILE_SIZE:
+            return 400, "text/plain", b"Bad metatile size"
+        if z > MAX_ZOOM or x >= (1 << z) or y >= (1 << z):
+            return 404, "text/plain", b"Tile out of range"
+
+        self.counters["metatiles"] += 1
+        n = min(n, 1 << z)
+        x, y = metatile_origin(x, y, n)
+        keys = [(x + i, y + j) for i in range(n) for j in range(n)]
+        results = await asyncio.gather(
+            *(self.getTile(z, tx, ty) for tx, ty in keys)
+        )
+
+        # Тайлы с временной ошибкой помечаются в индексе, чтобы клиент
+        # повторил только их. Ошибкой отвечаем, только если не загрузилось
+        # ничего - так её видит автомат защиты клиента
+        failed = {key for key, (status, _) in zip(keys, results) if status >= 500}
+        if len(failed) == len(keys):
+            status = max(status for status, _ in results)
+            return status, "text/plain", ERROR_TEXT[status]
+
+        tiles = {key: data for key, (_, data) in zip(keys, results)}
+
+        body = pack_metatile(z, x, y, n, tiles, failed)
+        return 200, "application/octet-stream", body
+
+    async def respond(
+        self, writer, status, body, content_type="text/plain", close=False
+    ):
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["upstream_requests"] = self.upstream.requests
+        stats["upstream_connections"] = self.upstream.connections_opened
+        return stats
+
+    async def serve(self, host="0.0.0.0", port=8080):
+        server = await asyncio.start_server(self.handleConnection, host, port)
+        print(f"Serve on {host}:{port}")
+        async with server:
+            await server.serve_forever()
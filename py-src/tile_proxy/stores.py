@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+
+def tile_digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class MemoryStore:
+    """
+    LRU-хранилище тайлов в памяти. Одинаковое содержимое хранится
+    один раз и разделяется между ключами.
+    """
+
+    def __init__(self, max_tiles=100000):
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()  # (z, x, y) -> хэш содержимого
+        self.blobs = {}  # Хэш содержимого -> [данные, число ссылок]
+
+    async def get(self, z, x, y):
+        key = (z, x, y)
+        digest = self.tiles.get(key)
+        if digest is None:
+            return None
+        self.tiles.move_to_end(key)
+        return self.blobs[digest][0]
+
+    async def put(self, z, x, y, data):
+        key = (z, x, y)
+        digest = tile_digest(data)
+
+        old_digest = self.tiles.pop(key, None)
+        if old_digest is not None:
+            self.release(old_digest)
+
+        self.tiles[key] = digest
+        self.blobs.setdefault(digest, [data, 0])[1] += 1
+
+        while len(self.tiles) > self.max_tiles:
+            _, evicted = self.tiles.popitem(last=False)
+            self.release(evicted)
+
+    def release(self, digest):
+        blob = self.blobs[digest]
+        blob[1] -= 1
+        if blob[1] <= 0:
+            del self.blobs[digest]
+
+    async def close(self):
+        pass
+
+
+class DiskStore:
+    """
+    Хранилище тайлов в каталоге. Содержимое лежит в blobs/<хэш>.png,
+    а tiles/{z}/{x}/{y}.png - жёсткие ссылки на него, поэтому
+    одинаковые тайлы занимают место на диске один раз.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+
+    def tilePath(self, z, x, y):
+        return os.path.join(self.root, "tiles", str(z), str(x), f"{y}.png")
+
+    def blobPath(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], f"{digest}.png")
+
+    async def get(self, z, x, y):
+        return await asyncio.to_thread(self.read, self.tilePath(z, x, y))
+
+    async def put(self, z, x, y, data):
+        await asyncio.to_thread(self.write, self.tilePath(z, x, y), data)
+
+    def read(self, path):
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path, data):
+        blob_path = self.blobPath(tile_digest(data))
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            self.writeAtomic(blob_path, data)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            # Файловая система без жёстких ссылок - храним копию
+            self.writeAtomic(path, data)
+            return
+        os.replace(tmp_path, path)
+
+    def writeAtomic(self, path, data):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def close(self):
+        pass
+
+
+class RedisStore:
+    """
+    Хранилище тайлов в Redis с ключами tile_{x}_{y}_{z}, как у cmd/server,
+    поэтому прокси и Go-сервер могут работать с одной базой.
+    """
+
+    def __init__(self, url="redis://localhost:6379/0"):
+        # Зависимость нужна только для этого хранилища
+        import redis.asyncio
+
+        self.redis = redis.asyncio.Redis.from_url(url)
+
+    async def get(self, z, x, y):
+        return await self.redis.get(f"tile_{x}_{y}_{z}")
+
+    async def put(self, z, x, y, data):
+        await self.redis.set(f"tile_{x}_{y}_{z}", data)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class MBTilesStore:
+    """
+    Хранилище тайлов в файле MBTiles (SQLite) со схемой map/images,
+    в которой одинаковые изображения хранятся один раз. Строки тайлов
+    хранятся в нумерации TMS, как требует спецификация MBTiles.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+        CREATE TABLE IF NOT EXISTS map (
+            zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS map_index
+            ON map (zoom_level, tile_column, tile_row);
+        CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+        CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+        CREATE VIEW IF NOT EXISTS tiles AS
+            SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                   map.tile_row AS tile_row, images.tile_data AS tile_data
+            FROM map JOIN images ON images.tile_id = map.tile_id;
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(self.SCHEMA)
+
+    async def get(self, z, x, y):
+        return await asyncio.to_thread(self.read, z, x, (1 << z) - 1 - y)
+
+    async def put(self, z, x, y, data):
+        await asyncio.to_thread(self.write, z, x, (1 << z) - 1 - y, data)
+
+    def read(self, z, x, row):
+        with self.lock:
+            result = self.connection.execute(
+                "SELECT tile_data FROM tiles"
+                " WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, row),
+            ).fetchone()
+        return bytes(result[0]) if result else None
+
+    def write(self, z, x, row, data):
+        digest = tile_digest(data)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                (data, digest),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO map"
+                " (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                (z, x, row, digest),
+            )
+
+    async def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_store(kind, path=None):
+    """Создаёт хранилище по имени: memory, disk, redis или mbtiles"""
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "disk":
+        return DiskStore(path or "tiles_cache")
+    if kind == "redis":
+        return RedisStore(path or "redis://localhost:6379/0")
+    if kind == "mbtiles":
+        return MBTilesStore(path or "tiles.mbtiles")
+
+    raise ValueError(f"Неизвестное хранилище: {kind}")
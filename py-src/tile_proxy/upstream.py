@@ -0,0 +1,146 @@
+import asyncio
+import random as rnd
+import ssl
+
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from .protocol import ProtocolError, read_head, read_body, keep_alive
+
+OSM_URL_TEMPLATES = [
+    "https://tile.openstreetmap.org/{z}/{x}/{y}.png",
+    "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png",
+    "https://b.tile.openstreetmap.org/{z}/{x}/{y}.png",
+    "https://c.tile.openstreetmap.org/{z}/{x}/{y}.png",
+]
+
+USER_AGENT = "OSM-Viewer/1.0 (contact@example.com)"
+
+
+class UpstreamConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class UpstreamPool:
+    """
+    Пул keep-alive соединений HTTP/1.1 к серверам тайлов.
+
+    Соединения к каждому хосту переиспользуются между запросами;
+    число одновременных соединений к хосту ограничено max_connections.
+    """
+
+    def __init__(
+        self,
+        url_templates=None,
+        max_connections=8,
+        timeout=10.0,
+        user_agent=USER_AGENT,
+    ):
+        self.url_templates = url_templates or OSM_URL_TEMPLATES
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.user_agent = user_agent
+
+        self.ssl_context = ssl.create_default_context()
+        self.idle = defaultdict(list)  # (scheme, host, port) -> свободные соединения
+        self.limits = {}  # (scheme, host, port) -> asyncio.Semaphore
+
+        self.requests = 0
+        self.connections_opened = 0
+
+    async def fetch(self, z, x, y):
+        """Загружает тайл с одного из серверов. Возвращает (status, body)"""
+        url = rnd.choice(self.url_templates).format(z=z, x=x, y=y)
+        return await asyncio.wait_for(self.get(url), self.timeout)
+
+    async def get(self, url):
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        origin = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        limit = self.limits.get(origin)
+        if limit is None:
+            limit = self.limits[origin] = asyncio.Semaphore(self.max_connections)
+
+        async with limit:
+            self.requests += 1
+            connection = self.takeIdle(origin)
+            if connection is not None:
+                try:
+                    return await self.roundTrip(origin, connection, path)
+                except (ConnectionError, ProtocolError, asyncio.IncompleteReadError):
+                    # Сервер мог закрыть простаивающее соединение - повторяем
+                    # запрос один раз по новому соединению
+                    connection.close()
+
+            connection = await self.connect(origin)
+            return await self.roundTrip(origin, connection, path)
+
+    def takeIdle(self, origin):
+        idle = self.idle[origin]
+        while idle:
+            connection = idle.pop()
+            if not connection.reader.at_eof():
+                return connection
+            connection.close()
+        return None
+
+    async def connect(self, origin):
+        scheme, host, port = origin
+        reader, writer = await asyncio.open_connection(
+            host,
+            port,
+            ssl=self.ssl_context if scheme == "https" else None,
+        )
+        self.connections_opened += 1
+        return UpstreamConnection(reader, writer)
+
+    async def roundTrip(self, origin, connection, path):
+        host = origin[1]
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"User-Agent: {self.user_agent}\r\n"
+            "Accept: image/png\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n"
+        )
+
+        try:
+            connection.writer.write(request.encode("latin-1"))
+            await connection.writer.drain()
+
+            head = await read_head(connection.reader)
+            if head is None:
+                raise ProtocolError("Сервер закрыл соединение без ответа")
+            status_line, headers = head
+            version, status, _ = (status_line.split(" ", 2) + [""])[:3]
+            body = await read_body(connection.reader, headers, until_close=True)
+        except BaseException:
+            connection.close()
+            raise
+
+        reusable = keep_alive(version, headers) and (
+            "content-length" in headers or "transfer-encoding" in headers
+        )
+        if reusable:
+            self.idle[origin].append(connection)
+        else:
+            connection.close()
+
+        return int(status), body
+
+    async def close(self):
+        for idle in self.idle.values():
+            for connection in idle:
+                connection.close()
+        self.idle.clear()
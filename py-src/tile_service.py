@@ -0,0 +1,560 @@
+import os
+import time
+import hashlib
+import weakref
+import shiboken6
+
+from collections import OrderedDict, deque
+from functools import partial
+from PySide6.QtCore import QObject, QUrl, QRunnable, QThreadPool, QTimer, Signal
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtNetwork import QNetworkRequest, QNetworkReply
+
+from failure_policy import NegativeCache, CircuitBreaker, backoff_delay
+from link_estimator import LinkEstimator
+from network_access_manager_pool import NetworkAccessManagerPool
+from tile_memory_cache import TileMemoryCache
+from tile_proxy.metatile import unpack_metatile
+
+TILE_URL = os.environ.get("OSM_TILE_URL", "http://localhost:8080/{z}/{x}/{y}.png")
+# Шаблон URL метатайлов с {n}, {z}, {x}, {y}, например
+# http://localhost:8080/meta/{n}/{z}/{x}/{y}.bin у tile_proxy. Если не задан,
+# каждый тайл загружается отдельным запросом.
+METATILE_URL = os.environ.get("OSM_METATILE_URL")
+
+
+class TileDecodeSignals(QObject):
+    decoded = Signal(object, QImage)
+
+
+class TileDecodeTask(QRunnable):
+    """Декодирование содержимого тайла в QImage в рабочем потоке"""
+
+    def __init__(self, digest, data, signals):
+        super().__init__()
+        self.digest = digest
+        self.data = data
+        self.signals = signals
+
+    def run(self):
+        image = QImage()
+        image.loadFromData(self.data)
+        self.signals.decoded.emit(self.digest, image)
+
+
+class TileService(QObject):
+    """
+    Общий для всего процесса сервис загрузки тайлов.
+
+    Все виды карты подписываются на один экземпляр (TileService.instance()),
+    поэтому кэш декодированных тайлов, пул сетевых менеджеров и потоки
+    декодирования общие. Одинаковые тайлы запрашиваются один раз
+    независимо от числа видов, а очереди видов обслуживаются по кругу.
+
+    Тайлы адресуются по содержимому: побайтно одинаковые тайлы (море, пустая
+    суша) декодируются один раз и разделяют один QPixmap. Степень
+    дедупликации возвращает stats().
+
+    Кэш в памяти двухуровневый (TileMemoryCache): немного декодированных
+    QPixmap и намного больше тайлов в исходном сжатом виде. Тайл из сжатого
+    уровня декодируется в рабочем потоке без запроса в сеть.
+
+    Таймаут запросов и число одновременных загрузок подстраиваются под
+    наблюдаемый канал (LinkEstimator); progressiveLevels() подсказывает видам,
+    на сколько уровней грубее сначала загрузить видимую область.
+
+    Временные ошибки повторяются с экспоненциальной задержкой, а автомат
+    защиты каждого upstream приостанавливает запросы при всплеске ошибок.
+    Отсутствующие и битые тайлы попадают в негативный кэш: пока запись
+    жива (isFailed), тайл не запрашивается.
+
+    Если задан metatile_url, тайлы загружаются блоками metatile_size x
+    metatile_size одним запросом и раскладываются по отдельным ключам кэша.
+    Тайлы, которые сервер пометил в метатайле временной ошибкой, повторяются
+    по URL отдельного тайла, и сбойный тайл не мешает загрузке блока.
+
+    Подписчик должен реализовать handleTileLoaded(z, x, y, pixmap)
+    и handleTileFailed(z, x, y).
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(
+        self,
+        url_template=TILE_URL,
+        metatile_url=METATILE_URL,
+        metatile_size=4,
+        manager_count=100,
+        max_in_flight=64,
+        hot_cache_bytes=64 * 1024**2,
+        warm_cache_bytes=128 * 1024**2,
+        decode_threads=4,
+        parent=None,
+    ):
+        super().__init__(parent)
+
+        self.url_template = url_template
+        self.metatile_url = metatile_url
+        self.metatile_size = metatile_size
+
+        self.network_manager_pool = NetworkAccessManagerPool(self, manager_count)
+        # Число одновременных запросов не превышает max_in_flight
+        self.link = LinkEstimator(max_concurrency=max_in_flight)
+        self.in_flight = 0
+
+        self.decode_pool = QThreadPool(self)
+        self.decode_pool.setMaxThreadCount(decode_threads)
+        self.decode_signals = TileDecodeSignals(self)
+        self.decode_signals.decoded.connect(self.handleTileDecoded)
+
+        # Декодированные QPixmap до hot_cache_bytes и сжатые тайлы
+        # до warm_cache_bytes
+        self.memory = TileMemoryCache(hot_cache_bytes, warm_cache_bytes)
+        self.decoding = {}  # Хэш содержимого -> ключи, ожидающие декодирования
+        self.promoting = set()  # Хэши, декодируемые из сжатого уровня кэша
+        self.subscribers = {}  # (z, x, y) -> виды, ожидающие тайл
+        self.active = set()  # Тайлы, которые загружаются или декодируются
+        self.queues = {}  # weakref вида -> очередь ключей (z, x, y)
+        self.round_robin = deque()  # Порядок обхода очередей видов
+
+        self.max_retries = 4
+        self.retry_failed_ttl = 30.0  # с, после исчерпания повторов
+        self.negative = NegativeCache()
+        self.breakers = {}  # (хост, порт) -> CircuitBreaker
+        self.attempts = {}  # (z, x, y) -> число неудачных попыток подряд
+        self.retrying = set()  # Тайлы, ожидающие повтора
+        # Тайлы, которые метатайл пометил временной ошибкой: повторяются
+        # отдельными запросами
+        self.single_tiles = set()
+        self.retry_queue = deque()  # Тайлы, запускаемые раньше очередей видов
+
+        self.dispatch_timer = QTimer(self)
+        self.dispatch_timer.setSingleShot(True)
+        self.dispatch_timer.timeout.connect(self.dispatch)
+
+        self.payload_count = 0  # Получено тайлов
+        self.payload_bytes = 0
+        self.unique_count = 0
+        self.unique_bytes = 0
+        # Недавно встреченные хэши содержимого (LRU), по ним считаются
+        # уникальные тайлы; объём ограничен max_seen_digests
+        self.seen_digests = OrderedDict()
+        self.max_seen_digests = 65536
+
+    def requestTile(self, view, z, x, y, front=False):
+        """
+        Возвращает QPixmap, если тайл декодирован и есть в кэше. Иначе
+        подписывает вид на тайл: сжатый тайл из кэша декодируется, остальные
+        ставятся в очередь вида (в начало при front). Результат придёт
+        в handleTileLoaded / handleTileFailed.
+        """
+        key = (z, x, y)
+        digest = self.memory.digest(key)
+        if digest is not None:
+            pixmap = self.memory.image(digest)
+            if pixmap is not None:
+                return pixmap
+
+        if digest is None and self.negative.contains(key):
+            return None
+
+        self.subscribers.setdefault(key, weakref.WeakSet()).add(view)
+        if key in self.active or key in self.retrying:
+            return None
+
+        if digest is not None:
+            # Тайл есть в сжатом уровне кэша - сеть не нужна
+            self.active.add(key)
+            self.promoting.add(digest)
+            self.decodeTile(key, digest, self.memory.data(digest))
+            return None
+
+        view_ref = weakref.ref(view)
+        queue = self.queues.get(view_ref)
+        if queue is None:
+            queue = self.queues[view_ref] = deque()
+            self.round_robin.append(view_ref)
+        if front:
+            queue.appendleft(key)
+        else:
+            queue.append(key)
+
+        self.dispatch()
+        return None
+
+    def cancelRequests(self, view):
+        """Снимает все подписки и запросы вида, которые ещё не начаты"""
+        view_ref = weakref.ref(view)
+        if self.queues.pop(view_ref, None) is not None:
+            # Ссылка на вид есть в round_robin, пока есть его очередь;
+            # иначе новая очередь получила бы второе место в обходе
+            self.round_robin.remove(view_ref)
+        for key in list(self.subscribers):
+            views = self.subscribers[key]
+            views.discard(view)
+            if views or key in self.active or key in self.retrying:
+                continue
+            del self.subscribers[key]
+
+    def cancelTile(self, view, z, x, y):
+        """Снимает подписку вида на один тайл и убирает его из очереди вида"""
+        key = (z, x, y)
+        queue = self.queues.get(weakref.ref(view))
+        if queue and key in queue:
+            queue.remove(key)
+
+        views = self.subscribers.get(key)
+        if views is None:
+            return
+        views.discard(view)
+        if not views and key not in self.active and key not in self.retrying:
+            del self.subscribers[key]
+
+    def isFailed(self, z, x, y):
+        """Тайл недавно не загрузился и пока не будет запрашиваться"""
+        return self.negative.contains((z, x, y))
+
+    def dispatch(self):
+        """
+        Запускает загрузки: сначала повторы, затем по одной из очереди каждого
+        вида по кругу. Пока автомат защиты upstream разомкнут, ждёт.
+        """
+        while self.in_flight < self.link.concurrency:
+            key = self.nextKey()
+            if key is None:
+                return
+
+            url = self.tileUrl(key)
+            breaker = self.breakerFor(url)
+            if not breaker.allowRequest():
+                self.retry_queue.appendleft(key)
+                delay = breaker.retryAfter()
+                # Во время пробного запроса dispatch() вызовет его ответ
+                if delay is not None:
+                    self.scheduleDispatch(delay)
+                return
+
+            breaker.onRequest()
+            self.loadTile(key, url)
+
+    def nextKey(self):
+        while self.retry_queue:
+            key = self.retry_queue.popleft()
+            if self.isWanted(key):
+                return key
+
+        while self.round_robin:
+            view_ref = self.round_robin.popleft()
+            queue = self.queues.get(view_ref)
+            view = view_ref()
+            if view is None or not shiboken6.isValid(view) or not queue:
+                self.queues.pop(view_ref, None)
+                continue
+
+            key = queue.popleft()
+            if queue:
+                self.round_robin.append(view_ref)
+            else:
+                del self.queues[view_ref]
+
+            if self.isWanted(key):
+                return key
+
+        return None
+
+    def isWanted(self, key):
+        # Тайл мог загрузиться по запросу другого вида или стать ненужным
+        return (
+            key not in self.active
+            and key not in self.retrying
+            and key not in self.memory
+            and bool(self.subscribers.get(key))
+        )
+
+    def scheduleDispatch(self, delay):
+        msec = int(delay * 1000) + 1
+        timer = self.dispatch_timer
+        if not timer.isActive() or timer.remainingTime() > msec:
+            timer.start(msec)
+
+    def useMetatile(self, key):
+        return bool(self.metatile_url) and key not in self.single_tiles
+
+    def tileUrl(self, key):
+        z, x, y = key
+        if self.useMetatile(key):
+            n = self.metatile_size
+            return self.metatile_url.format(n=n, z=z, x=x - x % n, y=y - y % n)
+        return self.url_template.format(z=z, x=x, y=y)
+
+    def metatileKeys(self, key):
+        """Ключи тайлов метатайла, содержащего key, в пределах мира"""
+        z, x, y = key
+        n = min(self.metatile_size, 2**z)
+        x0, y0 = x - x % n, y - y % n
+        return [(z, x0 + i, y0 + j) for i in range(n) for j in range(n)]
+
+    def breakerFor(self, url):
+        qurl = QUrl(url)
+        origin = (qurl.host(), qurl.port())
+        breaker = self.breakers.get(origin)
+        if breaker is None:
+            breaker = self.breakers[origin] = CircuitBreaker()
+        return breaker
+
+    def loadTile(self, key, url):
+        """
+        Запрашивает тайл, а при заданном metatile_url - весь его метатайл.
+        Остальные тайлы метатайла помечаются загружаемыми, и их запросы
+        присоединяются к этому.
+        """
+        keys = [key]
+        is_metatile = self.useMetatile(key)
+        if is_metatile:
+            keys += [
+                other
+                for other in self.metatileKeys(key)
+                if other != key
+                and other not in self.active
+                and other not in self.memory
+                and not self.negative.contains(other)
+            ]
+
+        for other in keys:
+            self.retrying.discard(other)
+            self.active.add(other)
+
+        request = QNetworkRequest(QUrl(url))
+        request.setTransferTimeout(self.link.timeout())
+        reply = self.network_manager_pool.getNetworkManager().get(request)
+        reply.finished.connect(
+            partial(
+                self.handleTileReply,
+                reply,
+                keys,
+                url,
+                is_metatile,
+                time.monotonic(),
+            )
+        )
+        self.in_flight += 1
+        self.link.requestStarted()
+
+    def progressiveLevels(self):
+        """На сколько уровней грубее стоит сначала загрузить видимую область"""
+        return self.link.quality()
+
+    def handleTileReply(self, reply, keys, url, is_metatile, started):
+        self.in_flight -= 1
+        breaker = self.breakerFor(url)
+        err = reply.error()
+        if err != QNetworkReply.NetworkError.NoError:
+            if err in (
+                QNetworkReply.NetworkError.TimeoutError,
+                QNetworkReply.NetworkError.OperationCanceledError,
+            ):
+                self.link.addTimeout()
+            self.link.requestFinished()
+
+            print(f"Error: {err} Ошибка загрузки {url}: {reply.errorString()}")
+            status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+            reply.deleteLater()
+
+            if status in (404, 410):
+                # Сервер ответил, что тайла нет - повторять бессмысленно
+                breaker.recordSuccess()
+                for key in keys:
+                    self.negative.add(key)
+                    self.failTile(key)
+            elif status is not None and 400 <= status < 500 and status != 429:
+                # Прочие ошибки клиента могут пройти (403 при ограничении
+                # доступа), поэтому тайл скрывается ненадолго
+                breaker.recordSuccess()
+                for key in keys:
+                    self.negative.add(key, self.retry_failed_ttl)
+                    self.failTile(key)
+            else:
+                breaker.recordFailure()
+                for key in keys:
+                    self.retryTile(key)
+            return
+
+        data = bytes(reply.readAll())
+        reply.deleteLater()
+        breaker.recordSuccess()
+        self.link.requestFinished(len(data))
+        self.link.addSample((time.monotonic() - started) * 1000)
+
+        if is_metatile:
+            self.ingestMetatile(keys, data)
+        else:
+            self.ingestTile(keys[0], data)
+
+    def ingestMetatile(self, keys, data):
+        """Раскладывает метатайл по тайлам; пустые записи - отсутствующие тайлы"""
+        try:
+            z, tiles, failed = unpack_metatile(data)
+        except ValueError as e:
+            print(f"Не могу разобрать метатайл: {e}")
+            for key in keys:
+                self.retryTile(key)
+            return
+
+        for key in keys:
+            payload = tiles.get(key[1:]) if key[0] == z else None
+            if payload:
+                self.ingestTile(key, payload)
+            elif key[0] == z and key[1:] in failed:
+                self.single_tiles.add(key)
+                self.retryTile(key)
+            else:
+                # Сервер метатайлов может записать пустой тайл и при сбое
+                # upstream, поэтому отсутствие запоминается ненадолго
+                self.negative.add(key, self.retry_failed_ttl)
+                self.failTile(key)
+
+    def ingestTile(self, key, data):
+        """
+        Принимает содержимое тайла и сохраняет его в сжатом уровне кэша.
+        Если такое же содержимое уже декодировано или декодируется, тайл
+        использует его вместо повторного декодирования.
+        """
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+
+        self.payload_count += 1
+        self.payload_bytes += len(data)
+        if digest in self.seen_digests:
+            self.seen_digests.move_to_end(digest)
+        else:
+            self.seen_digests[digest] = None
+            self.unique_count += 1
+            self.unique_bytes += len(data)
+            if len(self.seen_digests) > self.max_seen_digests:
+                self.seen_digests.popitem(last=False)
+
+        self.memory.put(key, digest, data)
+        pixmap = self.memory.image(digest)
+        if pixmap is not None:
+            self.completeTile(key, pixmap)
+        else:
+            self.decodeTile(key, digest, data)
+
+    def decodeTile(self, key, digest, data):
+        keys = self.decoding.get(digest)
+        if keys is not None:
+            keys.append(key)
+            return
+
+        self.decoding[digest] = [key]
+        self.decode_pool.start(TileDecodeTask(digest, data, self.decode_signals))
+
+    def handleTileDecoded(self, digest, image):
+        keys = self.decoding.pop(digest, [])
+        if image.isNull():
+            self.promoting.discard(digest)
+            for key in keys:
+                z, x, y = key
+                print(f"Не могу загрузить тайл ({z}/{x}/{y})")
+                self.memory.discard(key)
+                self.negative.add(key)
+                self.failTile(key)
+            return
+
+        pixmap = QPixmap.fromImage(image)
+        self.memory.addImage(
+            digest,
+            pixmap,
+            pixmap.width() * pixmap.height() * pixmap.depth() // 8,
+            promoted=digest in self.promoting,
+        )
+        self.promoting.discard(digest)
+        for key in keys:
+            self.completeTile(key, pixmap)
+
+    def completeTile(self, key, pixmap):
+        self.attempts.pop(key, None)
+        self.single_tiles.discard(key)
+        self.active.discard(key)
+        for view in self.takeSubscribers(key):
+            view.handleTileLoaded(*key, pixmap)
+
+        self.dispatch()
+
+    def retryTile(self, key):
+        """Повторяет тайл после временной ошибки или сдаётся после max_retries"""
+        self.active.discard(key)
+
+        attempt = self.attempts.get(key, 0) + 1
+        if attempt > self.max_retries:
+            self.negative.add(key, self.retry_failed_ttl)
+            self.failTile(key)
+            return
+
+        self.attempts[key] = attempt
+        self.retrying.add(key)
+        delay = int(backoff_delay(attempt) * 1000)
+        QTimer.singleShot(delay, partial(self.handleRetryTimeout, key))
+
+        self.dispatch()
+
+    def handleRetryTimeout(self, key):
+        self.retrying.discard(key)
+        if not self.subscribers.get(key):
+            self.attempts.pop(key, None)
+            self.single_tiles.discard(key)
+            self.subscribers.pop(key, None)
+            return
+
+        self.retry_queue.append(key)
+        self.dispatch()
+
+    def failTile(self, key):
+        self.active.discard(key)
+        self.attempts.pop(key, None)
+        self.single_tiles.discard(key)
+        for view in self.takeSubscribers(key):
+            view.handleTileFailed(*key)
+
+        self.dispatch()
+
+    def takeSubscribers(self, key):
+        views = self.subscribers.pop(key, ())
+        return [view for view in views if shiboken6.isValid(view)]
+
+    def stats(self):
+        """
+        Статистика сервиса. dedup_ratio - сколько полученных тайлов приходится
+        на одно уникальное содержимое (содержимое, вытесненное из
+        seen_digests, при повторе считается заново), memory_dedup_ratio - сколько тайлов
+        кэша приходится на одно хранимое содержимое; memory - заполнение
+        уровней кэша в памяти.
+        """
+        unique_count = self.unique_count
+        memory = self.memory.stats()
+        return {
+            "tiles": self.payload_count,
+            "unique_tiles": unique_count,
+            "bytes": self.payload_bytes,
+            "unique_bytes": self.unique_bytes,
+            "dedup_ratio": self.payload_count / unique_count if unique_count else 1.0,
+            "cached_tiles": memory["tiles"],
+            "cached_pixmaps": memory["hot_images"],
+            "memory_dedup_ratio": (
+                memory["tiles"] / memory["warm_blobs"] if memory["warm_blobs"] else 1.0
+            ),
+            "memory": memory,
+            "link": self.link.stats(),
+            "requests_in_flight": self.in_flight,
+            "negative_tiles": len(self.negative),
+            "retrying_tiles": len(self.retrying),
+            "breakers": {
+                f"{host}:{port}": breaker.state
+                for (host, port), breaker in self.breakers.items()
+            },
+        }
@@ -0,0 +1,126 @@
+from PySide6.QtCore import Qt, QPointF, QVariantAnimation, QEasingCurve, Signal
+from PySide6.QtGui import QPainter
+from PySide6.QtWidgets import QWidget
+
+
+class ZoomTransition(QWidget):
+    """
+    Анимированный переход между уровнями зума.
+
+    В начале перехода видимая область один раз снимается в QPixmap, после чего
+    анимируется только масштаб этого снимка - элементы сцены не перегруппируются.
+    Быстрые прокрутки колеса накапливаются в один целевой уровень зума, поэтому
+    тайлы промежуточных уровней не загружаются.
+    """
+
+    # Целевой уровень зума и точка привязки в координатах viewport
+    zoomCommitted = Signal(float, QPointF)
+
+    def __init__(self, view, duration=250, min_zoom=0, max_zoom=19):
+        super().__init__(view.viewport())
+
+        self.view = view
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.hide()
+
+        self.snapshot = None  # Снимок viewport на момент начала перехода
+        self.anchor = QPointF()  # Точка, относительно которой идёт масштабирование
+        self.start_zoom = 0
+        self.target_zoom = 0
+        self.scale = 1.0
+        self.opacity = 1.0
+
+        self.scale_anim = QVariantAnimation(self)
+        self.scale_anim.setDuration(duration)
+        self.scale_anim.setEasingCurve(QEasingCurve.OutCubic)
+        self.scale_anim.valueChanged.connect(self.onScaleChanged)
+        self.scale_anim.finished.connect(self.commit)
+
+        self.fade_anim = QVariantAnimation(self)
+        self.fade_anim.setDuration(150)
+        self.fade_anim.setStartValue(1.0)
+        self.fade_anim.setEndValue(0.0)
+        self.fade_anim.valueChanged.connect(self.onOpacityChanged)
+        self.fade_anim.finished.connect(self.finish)
+
+    def isRunning(self):
+        return self.scale_anim.state() == QVariantAnimation.Running
+
+    def addSteps(self, steps, anchor):
+        """
+        Добавляет steps уровней к целевому зуму. Переход всегда заканчивается
+        на целом уровне, даже если начался с дробного.
+        Если переход ещё не идёт, снимает текущий вид и начинает новый.
+        """
+        if not self.isRunning():
+            target = self.clampZoom(round(self.view.zoom_level) + steps)
+            if target == self.view.zoom_level:
+                return
+            self.start(anchor)
+
+        target = self.clampZoom(round(self.target_zoom) + steps)
+        if target == self.target_zoom:
+            return
+        self.target_zoom = target
+
+        # Перезапускаем анимацию от текущего масштаба к новому целевому
+        self.scale_anim.stop()
+        self.scale_anim.setStartValue(self.scale)
+        self.scale_anim.setEndValue(float(2 ** (self.target_zoom - self.start_zoom)))
+        self.scale_anim.start()
+
+    def clampZoom(self, zoom):
+        return min(max(zoom, self.min_zoom), self.max_zoom)
+
+    def start(self, anchor):
+        self.fade_anim.stop()
+        self.hide()
+
+        viewport = self.view.viewport()
+        self.snapshot = viewport.grab()
+        self.setGeometry(viewport.rect())
+
+        self.anchor = QPointF(anchor)
+        self.start_zoom = self.view.zoom_level
+        self.target_zoom = self.view.zoom_level
+        self.scale = 1.0
+        self.opacity = 1.0
+
+        self.show()
+        self.raise_()
+
+    def commit(self):
+        """Применяет накопленный зум к виду и плавно убирает снимок"""
+        self.zoomCommitted.emit(self.target_zoom, self.anchor)
+        self.fade_anim.start()
+
+    def finish(self):
+        self.hide()
+        self.snapshot = None
+
+    def onScaleChanged(self, value):
+        self.scale = value
+        self.update()
+
+    def onOpacityChanged(self, value):
+        self.opacity = value
+        self.update()
+
+    def paintEvent(self, event):
+        if self.snapshot is None:
+            return
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.setOpacity(self.opacity)
+
+        # При отдалении снимок не покрывает весь viewport
+        painter.fillRect(self.rect(), self.palette().base())
+
+        painter.translate(self.anchor)
+        painter.scale(self.scale, self.scale)
+        painter.translate(-self.anchor)
+        painter.drawPixmap(0, 0, self.snapshot)